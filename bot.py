@@ -1,74 +1,218 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters
 from PIL import Image, ImageDraw, ImageFont
+import asyncio
+import concurrent.futures
+import functools
 import io
 import os
+import re
 
 
 # ======= DIP Image Generator =======
-def generate_dip_image(binary_str: str) -> Image.Image:
+SWITCH_WIDTH = 32
+SWITCH_HEIGHT = 80
+SWITCH_SPACING = 6
+MARGIN = 20
+
+# Palette indices: the image only ever uses these three colors
+RED, WHITE, BLACK = 0, 1, 2
+PALETTE = [0xcc, 0x00, 0x00, 0xff, 0xff, 0xff, 0x00, 0x00, 0x00]
+
+# Worker threads for Pillow rendering, so image generation doesn't block the event loop
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_fonts() -> tuple:
     """
-    Generate an image of a DIP switch based on a binary string.
+    Load the regular and bold fonts once and reuse them for every image.
+
+    Returns:
+        tuple: (font, font_bold), falling back to Pillow's default font if Arial is unavailable.
+    """
+    try:
+        return ImageFont.truetype("arial.ttf", 14), ImageFont.truetype("arialbd.ttf", 16)
+    except IOError:
+        default = ImageFont.load_default()
+        return default, default
+
+
+def _new_canvas(size: tuple, color: int) -> Image.Image:
+    """
+    Create a paletted image using the DIP palette.
 
     Args:
-        binary_str (str): Binary string (e.g., "01000100") representing the DIP switch state.
+        size (tuple): (width, height) of the image.
+        color (int): Palette index to fill the image with.
 
     Returns:
-        Image.Image: Generated image of the DIP switch.
+        Image.Image: Mode "P" image.
     """
-    num_switches = len(binary_str)
-    switch_width = 32
-    switch_height = 80
-    spacing = 6
-    margin = 20
+    img = Image.new("P", size, color=color)
+    img.putpalette(PALETTE)
+    return img
+
+
+def _make_switch_tile(on: bool) -> Image.Image:
+    """
+    Draw a single DIP switch (frame and lever) on the red panel background.
+
+    Args:
+        on (bool): If True, the white lever is drawn in the upper (ON) half.
+
+    Returns:
+        Image.Image: Tile of size (SWITCH_WIDTH + 1, SWITCH_HEIGHT + 1) ready to be pasted.
+    """
+    w, h = SWITCH_WIDTH, SWITCH_HEIGHT
+    tile = _new_canvas((w + 1, h + 1), RED)
+    draw = ImageDraw.Draw(tile)
+
+    # DIP switch slot (frame)
+    draw.rectangle([0, 0, w, h], outline=BLACK, width=2)
+
+    upper = [2, 2, w - 2, h // 2]
+    lower = [2, h // 2, w - 2, h - 2]
+    if on:
+        # ON: white top (up)
+        draw.rectangle(upper, fill=WHITE)
+        draw.rectangle(lower, fill=RED)
+    else:
+        # OFF: white bottom (down)
+        draw.rectangle(lower, fill=WHITE)
+        draw.rectangle(upper, fill=RED)
+
+    return tile
+
+
+ON_TILE = _make_switch_tile(on=True)
+OFF_TILE = _make_switch_tile(on=False)
+_TILES = {"1": ON_TILE, "0": OFF_TILE}
+
+
+def _precompute_geometry(bits: int) -> tuple:
+    """
+    Compute the image layout for a DIP switch with the given number of switches.
+
+    Args:
+        bits (int): Number of switches on the DIP.
+
+    Returns:
+        tuple: (size, panel_rect, on_label_pos, switch_positions, label_positions).
+    """
+    total_width = bits * (SWITCH_WIDTH + SWITCH_SPACING) + MARGIN * 2 - SWITCH_SPACING
+    total_height = SWITCH_HEIGHT + 80
+
+    dip_top = 50
+    dip_bottom = dip_top + SWITCH_HEIGHT
+    panel_rect = (MARGIN - 10, dip_top - 30, total_width - MARGIN + 10, dip_bottom + 30)
+    on_label_pos = (MARGIN, dip_top - 25)
+
+    xs = tuple(MARGIN + i * (SWITCH_WIDTH + SWITCH_SPACING) for i in range(bits))
+    switch_positions = tuple((x, dip_top) for x in xs)
+    label_positions = tuple((x + SWITCH_WIDTH // 2 - 5, dip_top + SWITCH_HEIGHT + 5) for x in xs)
+
+    return (total_width, total_height), panel_rect, on_label_pos, switch_positions, label_positions
 
-    total_width = num_switches * (switch_width + spacing) + margin * 2 - spacing
-    total_height = switch_height + 80
 
-    img = Image.new("RGB", (total_width, total_height), color="white")
+def _make_base(bits: int) -> Image.Image:
+    """
+    Draw the static part of a DIP switch image: the red panel with its border, the ON label and the switch numbers.
+
+    Args:
+        bits (int): Number of switches on the DIP.
+
+    Returns:
+        Image.Image: Background image to be copied and filled with switches.
+    """
+    geometry = _GEOMETRY[bits] if bits in _GEOMETRY else _precompute_geometry(bits)
+    size, panel_rect, on_label_pos, _, label_positions = geometry
+
+    img = _new_canvas(size, WHITE)
     draw = ImageDraw.Draw(img)
+    draw.fontmode = "1"  # No antialiasing: blended palette indices would be meaningless
 
     # Red background panel with black border
-    dip_top = 50
-    dip_bottom = dip_top + switch_height
-    panel_rect = [margin - 10, dip_top - 30, total_width - margin + 10, dip_bottom + 30]
-    draw.rectangle(panel_rect, fill="#cc0000", outline="black", width=2)
+    draw.rectangle(panel_rect, fill=RED, outline=BLACK, width=2)
 
     # Font setup
-    try:
-        font = ImageFont.truetype("arial.ttf", 14)
-        font_bold = ImageFont.truetype("arialbd.ttf", 16)
-    except IOError:
-        font = ImageFont.load_default()
-        font_bold = ImageFont.load_default()
+    font, font_bold = _get_fonts()
 
     # ON label (white)
-    draw.text((margin, dip_top - 25), "ON", fill="white", font=font_bold)
+    draw.text(on_label_pos, "ON", fill=WHITE, font=font_bold)
+
+    # Switch numbers (white)
+    for number, label_pos in enumerate(label_positions, 1):
+        draw.text(label_pos, str(number), fill=WHITE, font=font)
+
+    return img
+
+
+def _to_dip_binary(bits: int, address: int) -> str:
+    """
+    Convert an address to the switch states of a DIP, least significant bit first.
+
+    Args:
+        bits (int): Number of switches on the DIP.
+        address (int): Address to convert.
 
-    for i, bit in enumerate(binary_str):
-        x = margin + i * (switch_width + 6)
-        y = dip_top
+    Returns:
+        str: Binary string of length bits, e.g. "00100010" for 68 on 8 bits.
+    """
+    binary = format(address, f"0{bits}b")
+    return binary[::-1]  # Reverse the binary string to match DIP switch convention (LSB first)
+
+
+BIT_OPTIONS = (6, 8, 10, 12)
+_GEOMETRY = {bits: _precompute_geometry(bits) for bits in BIT_OPTIONS}
+_BASE = {bits: _make_base(bits) for bits in BIT_OPTIONS}
+
+
+def generate_dip_image(binary_str: str) -> Image.Image:
+    """
+    Generate an image of a DIP switch based on a binary string.
+
+    Args:
+        binary_str (str): Binary string (e.g., "01000100") representing the DIP switch state.
 
-        # DIP switch slot (frame)
-        draw.rectangle([x, y, x + switch_width, y + switch_height], outline="black", width=2)
+    Returns:
+        Image.Image: Generated image of the DIP switch.
+    """
+    num_switches = len(binary_str)
+    geometry = _GEOMETRY[num_switches] if num_switches in _GEOMETRY else _precompute_geometry(num_switches)
+    _, _, _, switch_positions, _ = geometry
 
-        if bit == '1':
-            # ON: white top (up)
-            draw.rectangle([x + 2, y + 2, x + switch_width - 2, y + switch_height // 2], fill="white")
-            draw.rectangle([x + 2, y + switch_height // 2, x + switch_width - 2, y + switch_height - 2], fill="#cc0000")
-        else:
-            # OFF: white bottom (down)
-            draw.rectangle([x + 2, y + switch_height // 2, x + switch_width - 2, y + switch_height - 2], fill="white")
-            draw.rectangle([x + 2, y + 2, x + switch_width - 2, y + switch_height // 2], fill="#cc0000")
+    base = _BASE[num_switches] if num_switches in _BASE else _make_base(num_switches)
+    img = base.copy()
 
-        # Switch number (white)
-        label_x = x + switch_width // 2 - 5
-        label_y = y + switch_height + 5
-        draw.text((label_x, label_y), str(i + 1), fill="white", font=font)
+    for bit, switch_pos in zip(binary_str, switch_positions):
+        # DIP switch slot with its lever (white half up for ON, down for OFF)
+        img.paste(_TILES[bit], switch_pos)
 
     return img
 
 
+@functools.lru_cache(maxsize=8192)
+def _render_png_bytes(bits: int, address: int) -> bytes:
+    """
+    Render the DIP switch for an address and encode it as PNG.
+
+    The result depends only on its arguments, so it is cached per (bits, address).
+
+    Args:
+        bits (int): Number of switches on the DIP.
+        address (int): Address to display, in the range 0..2**bits - 1.
+
+    Returns:
+        bytes: PNG-encoded image of the DIP switch.
+    """
+    image = generate_dip_image(_to_dip_binary(bits, address))
+
+    with io.BytesIO() as output:
+        image.save(output, format="PNG")
+        return output.getvalue()
+
+
 # ======= Language Setup =======
 LANG_TEXTS = {
     "ua": {
@@ -83,6 +227,18 @@ LANG_TEXTS = {
 
 
 # ======= Handlers =======
+_NUMBER_RE = re.compile(r"[+-]?\d+")
+
+# Keyboards are the same for every user, so they are built once
+_LANG_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Українська 🇺🇦", callback_data="lang_ua"),
+     InlineKeyboardButton("Čeština 🇨🇿", callback_data="lang_cz")]
+])
+_BITS_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton(str(bits), callback_data=f"bits_{bits}") for bits in BIT_OPTIONS]
+])
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Handle the /start command. Show language selection if not set, otherwise show bit options.
@@ -91,12 +247,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_bit_options(update, context)
         return
 
-    keyboard = [
-        [InlineKeyboardButton("Українська 🇺🇦", callback_data="lang_ua"),
-         InlineKeyboardButton("Čeština 🇨🇿", callback_data="lang_cz")]
-    ]
-    await update.message.reply_text("Виберіть мову / Zvolte jazyk:",
-                                    reply_markup=InlineKeyboardMarkup(keyboard))
+    await update.message.reply_text("Виберіть мову / Zvolte jazyk:", reply_markup=_LANG_KB)
 
 
 async def language_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -118,17 +269,21 @@ async def show_bit_options(update: Update, context: ContextTypes.DEFAULT_TYPE, e
         edit (bool): If True, edit the existing message instead of sending a new one.
     """
     lang = context.user_data.get("lang", "ua")
-    keyboard = [
-        [InlineKeyboardButton("6", callback_data="bits_6"),
-         InlineKeyboardButton("8", callback_data="bits_8"),
-         InlineKeyboardButton("10", callback_data="bits_10"),
-         InlineKeyboardButton("12", callback_data="bits_12")]
-    ]
     text = LANG_TEXTS[lang]["choose_bits"]
-    markup = InlineKeyboardMarkup(keyboard)
+    markup = _BITS_KB
 
     if edit:
-        await update.callback_query.edit_message_text(text=text, reply_markup=markup)
+        # Telegram rejects edits that don't change the message, e.g. when a language button is tapped twice
+        key = (lang, "bits_menu", update.callback_query.message.message_id)
+        if context.user_data.get("last_msg") == key:
+            return
+        # Store the key before awaiting, so a concurrent second tap already sees it
+        context.user_data["last_msg"] = key
+        try:
+            await update.callback_query.edit_message_text(text=text, reply_markup=markup)
+        except Exception:
+            context.user_data.pop("last_msg", None)
+            raise
     else:
         await update.message.reply_text(text, reply_markup=markup)
 
@@ -151,26 +306,26 @@ async def handle_number(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Handle the number input, convert it to binary, and generate a DIP switch image.
     """
+    text = update.message.text.strip()
     try:
-        address = int(update.message.text.strip())
-        bits = context.user_data.get("bits", 8)
-        max_value = (2 ** bits) - 1  # Maximum value for the given number of bits
-        if address < 0:
-            await update.message.reply_text("Число не може бути від'ємним / Číslo nemůže být záporné.")
-            return
-        if address > max_value:
-            await update.message.reply_text(f"Число занадто велике! Максимум для {bits} бітів: {max_value}.")
-            return
-        binary = format(address, f"0{bits}b")
-        binary = binary[::-1]  # Reverse the binary string to match DIP switch convention (LSB first)
-        image = generate_dip_image(binary)
-
-        with io.BytesIO() as output:
-            image.save(output, format="PNG")
-            output.seek(0)
-            await update.message.reply_photo(photo=output)
-    except:
+        # Check the format first so common typos don't go through int() raising
+        address = int(text) if _NUMBER_RE.fullmatch(text) else None
+    except ValueError:  # Too many digits for int()
+        address = None
+    if address is None:
         await update.message.reply_text("Будь ласка, введіть правильне число / Zadejte platné číslo.")
+        return
+
+    bits = context.user_data.get("bits", 8)
+    max_value = (2 ** bits) - 1  # Maximum value for the given number of bits
+    if address < 0:
+        await update.message.reply_text("Число не може бути від'ємним / Číslo nemůže být záporné.")
+        return
+    if address > max_value:
+        await update.message.reply_text(f"Число занадто велике! Максимум для {bits} бітів: {max_value}.")
+        return
+    data = await asyncio.get_running_loop().run_in_executor(_EXECUTOR, _render_png_bytes, bits, address)
+    await update.message.reply_photo(photo=data, filename="dip.png")
 
 
 # ======= Main =======
@@ -183,14 +338,21 @@ def main():
     if not TOKEN:
         raise ValueError("No TOKEN provided. Set the TOKEN environment variable.")
 
-    # Build and start the bot
-    app = ApplicationBuilder().token(TOKEN).build()
+    # Build and start the bot, processing all updates concurrently. This includes several updates
+    # from the same user, so per-user ordering is not guaranteed and handlers must tolerate that.
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .http_version("2")  # Concurrent replies share one connection; getUpdates stays on HTTP/1.1
+        .concurrent_updates(True)
+        .build()
+    )
 
     # Add handlers
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CallbackQueryHandler(language_selected, pattern="^lang_"))
     app.add_handler(CallbackQueryHandler(bits_selected, pattern="^bits_"))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_number))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_number, block=False))
 
     # Start polling
     app.run_polling()